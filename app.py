@@ -1,18 +1,23 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import time
-import json
+import hashlib
+import orjson
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 
-# Page configuration
-st.set_page_config(
-    page_title="AI Model Comparison",
-    page_icon="⚡",
-    layout="wide"
-)
+# OpenRouter endpoint and the headers shared by every request
+_ENDPOINT = "https://openrouter.ai/api/v1/chat/completions"
+_BASE_HEADERS = {
+    "Content-Type": "application/json",
+    "HTTP-Referer": "https://comparemodel.streamlit.app/",  # Add referer
+    "X-Title": "AI Model Comparison Tool",  # Add title
+    "Connection": "keep-alive"
+}
 
-# Custom CSS for better styling
-st.markdown("""
+_CSS = """
 <style>
     .main > div {
         padding-top: 2rem;
@@ -46,7 +51,17 @@ st.markdown("""
         font-weight: bold;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# Page configuration
+st.set_page_config(
+    page_title="AI Model Comparison",
+    page_icon="⚡",
+    layout="wide"
+)
+
+# Custom CSS for better styling
+st.markdown(_CSS, unsafe_allow_html=True)
 
 # Title and header
 st.title("⚡ AI Model Comparison Tool")
@@ -89,6 +104,9 @@ with st.sidebar:
     st.subheader("Parameters")
     max_tokens = st.slider("Max Tokens", 50, 2000, 200, 50)
     temperature = st.slider("Temperature", 0.0, 2.0, 0.7, 0.1)
+    
+    # Cached responses are reused for identical prompt, model and parameters
+    clear_cache = st.button("🗑️ Clear cache")
 
 # Main interface
 col1, col2 = st.columns([2, 1])
@@ -115,73 +133,272 @@ with col2:
     with col_b:
         test_model_2 = st.button(f"Test {model_2.split('/')[-1].upper()}")
 
-# Function to make API call
-def make_api_call(model, prompt, api_key, max_tokens, temperature):
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": "https://comparemodel.streamlit.app/",  # Add referer
-        "X-Title": "AI Model Comparison Tool"  # Add title
-    }
+# Longest Retry-After wait honoured between retries, in seconds
+RETRY_AFTER_MAX = 5
+
+# Retry policy that never sleeps longer than RETRY_AFTER_MAX, whatever Retry-After asks for
+class CappedRetry(Retry):
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, RETRY_AFTER_MAX)
+
+# Shared HTTP session so repeated calls reuse pooled keep-alive connections
+@st.cache_resource(show_spinner=False)
+def get_session():
+    # Transparently retry rate limits and gateway errors, honouring short Retry-After waits
+    retry = CappedRetry(
+        total=3,
+        read=0,  # Never retry a read timeout, the generation may already be running and billed
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["POST"],
+        respect_retry_after_header=True,
+        raise_on_status=False  # Hand the last error response back so it is reported as before
+    )
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry))
+    return session
+
+SESSION = get_session()
+
+# Number of streamed chunks to buffer between live preview updates
+STREAM_UPDATE_EVERY = 8
+
+# Models whose provider ignored "n" and streamed a single completion, these get one request per completion
+@st.cache_resource(show_spinner=False)
+def get_models_ignoring_n():
+    return set()
+
+MODELS_IGNORING_N = get_models_ignoring_n()
+
+# Function to make API call, identical requests are served from cache (underscored args are not hashed)
+# The cache is shared by all sessions, so entries are keyed on a digest of the API key rather than the key itself
+# Returns one result per completion, n > 1 asks for several completions of the prompt in a single request
+# completion_index tells apart separate requests for the same model, so they never share a cache entry
+@st.cache_data(ttl=3600, show_spinner=False)
+def make_api_call(model, prompt, max_tokens, temperature, api_key_digest, _api_key, _on_chunk=None, n=1,
+                  completion_index=0):
+    headers = {**_BASE_HEADERS, "Authorization": f"Bearer {_api_key}"}
     
     data = {
         "model": model,
         "messages": [{"role": "user", "content": prompt}],
         "temperature": temperature,
-        "max_tokens": max_tokens
+        "max_tokens": max_tokens,
+        "stream": True
     }
+    if n > 1:
+        data["n"] = n
     
-    start_time = time.time()
+    start_time = time.perf_counter()
     
     try:
-        response = requests.post(
-            "https://openrouter.ai/api/v1/chat/completions",
+        with SESSION.post(
+            _ENDPOINT,
             headers=headers,
-            json=data,
-            timeout=60
-        )
-        
-        end_time = time.time()
-        response_time = end_time - start_time
-        
-        if response.status_code == 200:
-            try:
-                result = response.json()
-                content = result['choices'][0]['message']['content']
-                
-                # Debug: Check if content is empty or None
-                if not content or content.strip() == "":
-                    content = "[Empty response from model]"
-                
-                return {
-                    "success": True,
-                    "content": content,
-                    "response_time": response_time,
-                    "word_count": len(content.split()),
-                    "char_count": len(content),
-                    "words_per_second": len(content.split()) / response_time if response_time > 0 else 0,
-                    "raw_response": result  # Add raw response for debugging
-                }
-            except (KeyError, IndexError, TypeError) as e:
-                return {
+            data=orjson.dumps(data),
+            timeout=60,
+            stream=True
+        ) as response:
+            
+            if response.status_code == 200:
+                parts = [[] for _ in range(n)]
+                first_token_times = [None] * n
+                chunk_count = 0
+                result = {}
+                line = b""
+                try:
+                    # Server-sent events: payload lines start with "data: ", others are keep-alive comments
+                    for line in response.iter_lines():
+                        if not line.startswith(b"data: "):
+                            continue
+                        payload = line[len(b"data: "):]
+                        # Keep reading to EOF so the connection goes back to the pool
+                        if payload == b"[DONE]":
+                            continue
+                        result = orjson.loads(payload)
+                        for choice in result['choices']:
+                            delta = choice['delta'].get('content')
+                            if not delta:
+                                continue
+                            index = choice.get('index', 0)
+                            if first_token_times[index] is None:
+                                first_token_times[index] = time.perf_counter()
+                            parts[index].append(delta)
+                            chunk_count += 1
+                            # Batch UI updates, refreshing on every chunk makes rendering the bottleneck
+                            if _on_chunk and chunk_count % STREAM_UPDATE_EVERY == 0:
+                                _on_chunk(["".join(part) for part in parts])
+                    
+                    end_time = time.perf_counter()
+                    response_time = end_time - start_time
+                    
+                    results = []
+                    for index in range(n):
+                        # Providers that ignore "n" only stream the first completion
+                        if index > 0 and not parts[index]:
+                            break
+                        
+                        content = "".join(parts[index])
+                        first_token_time = first_token_times[index]
+                        
+                        # Debug: Check if content is empty or None
+                        empty = not content or content.strip() == ""
+                        if empty:
+                            content = "[Empty response from model]"
+                        
+                        word_count = len(content.split())
+                        char_count = len(content)
+                        
+                        call_result = {
+                            "success": True,
+                            "content": content,
+                            "response_time": response_time,
+                            "time_to_first_token": first_token_time - start_time if first_token_time else response_time,
+                            "word_count": word_count,
+                            "char_count": char_count,
+                            "words_per_second": word_count / response_time if response_time > 0 else 0
+                        }
+                        # Only keep the last streamed chunk when it is needed to debug an empty response
+                        if empty:
+                            call_result["raw_response"] = result
+                        results.append(call_result)
+                    
+                    # Batched completions all report the one request's time
+                    if len(results) > 1:
+                        for call_result in results:
+                            call_result["shared_timing"] = True
+                    return results
+                except (KeyError, IndexError, TypeError, ValueError) as e:
+                    return [{
+                        "success": False,
+                        "error": f"Failed to parse response: {str(e)}",
+                        "response_time": time.perf_counter() - start_time,
+                        "raw_response": line.decode("utf-8", errors="replace")
+                    }] * n
+            else:
+                end_time = time.perf_counter()
+                response_time = end_time - start_time
+                return [{
                     "success": False,
-                    "error": f"Failed to parse response: {str(e)}",
+                    "error": f"Error {response.status_code}: {response.text}",
                     "response_time": response_time,
-                    "raw_response": response.text
-                }
-        else:
-            return {
-                "success": False,
-                "error": f"Error {response.status_code}: {response.text}",
-                "response_time": response_time,
-                "status_code": response.status_code
-            }
+                    "status_code": response.status_code
+                }] * n
     except requests.exceptions.RequestException as e:
-        return {
+        return [{
             "success": False,
             "error": f"Request failed: {str(e)}",
             "response_time": 0
-        }
+        }] * n
+
+# Function to run API calls in the background while streaming partial output into placeholders
+def run_api_calls(models, placeholders, prompt, api_key, max_tokens, temperature):
+    api_key_digest = hashlib.sha256(api_key.encode()).hexdigest()
+    
+    # Worker threads only fill these buffers, all Streamlit calls stay on the script thread
+    partial = [""] * len(models)
+    results = [None] * len(models)
+    
+    # One small pool per click, so a slow generation never queues other sessions' requests
+    executor = ThreadPoolExecutor(max_workers=len(models), thread_name_prefix="api-call")
+    
+    def completion_index(slot):
+        return models[:slot].count(models[slot])
+    
+    def submit(slots):
+        def on_chunk(texts):
+            for slot, text in zip(slots, texts):
+                partial[slot] = text
+        future = executor.submit(
+            make_api_call, models[slots[0]], prompt, max_tokens, temperature, api_key_digest, api_key, on_chunk,
+            n=len(slots), completion_index=completion_index(slots[0])
+        )
+        return future, slots
+    
+    # A model selected more than once is asked for several completions in one request, saving a round trip.
+    # Models already seen ignoring "n" get one concurrent request per slot instead.
+    slots_by_model = {}
+    for slot, model in enumerate(models):
+        key = slot if model in MODELS_IGNORING_N else model
+        slots_by_model.setdefault(key, []).append(slot)
+    try:
+        pending = [submit(slots) for slots in slots_by_model.values()]
+        
+        shown = [""] * len(models)
+        while pending:
+            wait([future for future, _ in pending], timeout=0.1)
+            for i, placeholder in enumerate(placeholders):
+                if partial[i] != shown[i]:
+                    shown[i] = partial[i]
+                    placeholder.markdown(shown[i])
+            
+            still_pending = []
+            for future, slots in pending:
+                if not future.done():
+                    still_pending.append((future, slots))
+                    continue
+                call_results = future.result()
+                for slot, result in zip(slots, call_results):
+                    results[slot] = result
+                
+                # Drop failed calls from the cache so clicking again actually retries them
+                if not call_results[0]["success"]:
+                    make_api_call.clear(
+                        models[slots[0]], prompt, max_tokens, temperature, api_key_digest, api_key,
+                        n=len(slots), completion_index=completion_index(slots[0])
+                    )
+                
+                # The provider ignored "n": remember that and request the missing completions concurrently
+                if len(call_results) < len(slots):
+                    MODELS_IGNORING_N.add(models[slots[0]])
+                    still_pending.extend(submit([slot]) for slot in slots[len(call_results):])
+            pending = still_pending
+    finally:
+        # Don't block a rerun on calls that are still streaming, they finish in the background
+        executor.shutdown(wait=False)
+    
+    for placeholder in placeholders:
+        placeholder.empty()
+    
+    return results
+
+# Only this function's cache is cleared, other cached resources stay untouched
+if clear_cache:
+    make_api_call.clear()
+    st.sidebar.success("✅ Cached responses cleared")
+
+# Function to display one model's response, shared by the compare and single test paths
+def render_result_panel(result, key=None):
+    if result["success"]:
+        st.success(f"Generated in {result['response_time']:.2f} seconds (first token after {result['time_to_first_token']:.2f}s)")
+        st.markdown("**Result:**")
+        # Debug info
+        if result["content"] == "[Empty response from model]":
+            st.warning("Model returned empty response")
+            with st.expander("Debug Info"):
+                st.json(result.get("raw_response", {}))
+        st.text_area("", value=result["content"], height=200, key=key, disabled=True)
+    else:
+        st.error(f"Error: {result['error']}")
+        with st.expander("Debug Info"):
+            st.text(result.get("raw_response", "No debug info available"))
+            if "status_code" in result:
+                st.text(f"Status Code: {result['status_code']}")
+
+# Function to display one model's text statistics
+def render_result_statistics(result):
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("Words", result['word_count'])
+    with col2:
+        st.metric("Characters", result['char_count'])
+    with col3:
+        st.metric("Words/sec", f"{result['words_per_second']:.1f}")
+    with col4:
+        st.metric("First token", f"{result['time_to_first_token']:.2f}s")
 
 # Function to display results
 def display_comparison_results(result1, result2, model1_name, model2_name):
@@ -203,66 +420,41 @@ def display_comparison_results(result1, result2, model1_name, model2_name):
     # Success indicators and response display
     col1, col2 = st.columns(2)
     
-    with col1:
-        st.subheader(f"{get_model_icon(model1_name)} {model1_name.split('/')[-1].upper()}")
-        if result1["success"]:
-            st.success(f"Generated in {result1['response_time']:.2f} seconds")
-            st.markdown("**Result:**")
-            # Debug info
-            if result1["content"] == "[Empty response from model]":
-                st.warning("Model returned empty response")
-                with st.expander("Debug Info"):
-                    st.json(result1.get("raw_response", {}))
-            st.text_area("", value=result1["content"], height=200, key="result1", disabled=True)
-        else:
-            st.error(f"Error: {result1['error']}")
-            with st.expander("Debug Info"):
-                st.text(result1.get("raw_response", "No debug info available"))
-                if "status_code" in result1:
-                    st.text(f"Status Code: {result1['status_code']}")
-    
-    with col2:
-        st.subheader(f"{get_model_icon(model2_name)} {model2_name.split('/')[-1].upper()}")
-        if result2["success"]:
-            st.success(f"Generated in {result2['response_time']:.2f} seconds")
-            st.markdown("**Result:**")
-            # Debug info
-            if result2["content"] == "[Empty response from model]":
-                st.warning("Model returned empty response")
-                with st.expander("Debug Info"):
-                    st.json(result2.get("raw_response", {}))
-            st.text_area("", value=result2["content"], height=200, key="result2", disabled=True)
-        else:
-            st.error(f"Error: {result2['error']}")
-            with st.expander("Debug Info"):
-                st.text(result2.get("raw_response", "No debug info available"))
-                if "status_code" in result2:
-                    st.text(f"Status Code: {result2['status_code']}")
+    for column, result, model_name, key in ((col1, result1, model1_name, "result1"), (col2, result2, model2_name, "result2")):
+        with column:
+            st.subheader(f"{get_model_icon(model_name)} {model_name.split('/')[-1].upper()}")
+            render_result_panel(result, key=key)
     
     # Performance comparison (only if both succeeded)
     if result1["success"] and result2["success"]:
         st.markdown("---")
         st.header("⚡ Performance Comparison")
         
-        # Determine faster model
-        faster_model = model1_name if result1["response_time"] < result2["response_time"] else model2_name
-        time_diff = abs(result1["response_time"] - result2["response_time"])
-        speed_improvement = (time_diff / max(result1["response_time"], result2["response_time"])) * 100
-        
-        col1, col2, col3 = st.columns(3)
-        
-        with col1:
-            st.markdown("**Model 1 Time**")
+        if result1.get("shared_timing") and result2.get("shared_timing"):
+            # Both completions came from one batched request, so neither model can be faster
+            st.markdown("**Shared Time**")
             st.markdown(f"### {result1['response_time']:.2f}s")
-        
-        with col2:
-            st.markdown("**Model 2 Time**")
-            st.markdown(f"### {result2['response_time']:.2f}s")
-        
-        with col3:
-            st.markdown("**Faster Model**")
-            st.markdown(f"### {faster_model.split('/')[-1].upper()}")
-            st.markdown(f"<span class='faster-badge'>↑ {speed_improvement:.1f}% faster</span>", unsafe_allow_html=True)
+            st.caption("Both completions were generated by a single batched request and share one timing.")
+        else:
+            # Determine faster model
+            faster_model = model1_name if result1["response_time"] < result2["response_time"] else model2_name
+            time_diff = abs(result1["response_time"] - result2["response_time"])
+            speed_improvement = (time_diff / max(result1["response_time"], result2["response_time"])) * 100
+            
+            col1, col2, col3 = st.columns(3)
+            
+            with col1:
+                st.markdown("**Model 1 Time**")
+                st.markdown(f"### {result1['response_time']:.2f}s")
+            
+            with col2:
+                st.markdown("**Model 2 Time**")
+                st.markdown(f"### {result2['response_time']:.2f}s")
+            
+            with col3:
+                st.markdown("**Faster Model**")
+                st.markdown(f"### {faster_model.split('/')[-1].upper()}")
+                st.markdown(f"<span class='faster-badge'>↑ {speed_improvement:.1f}% faster</span>", unsafe_allow_html=True)
         
         # Text Statistics
         st.markdown("---")
@@ -270,79 +462,39 @@ def display_comparison_results(result1, result2, model1_name, model2_name):
         
         col1, col2 = st.columns(2)
         
-        with col1:
-            st.markdown(f"**{model1_name.split('/')[-1].upper()} Statistics:**")
-            st.markdown(f"• Words: {result1['word_count']}")
-            st.markdown(f"• Characters: {result1['char_count']}")
-            st.markdown(f"• Words/second: {result1['words_per_second']:.1f}")
-        
-        with col2:
-            st.markdown(f"**{model2_name.split('/')[-1].upper()} Statistics:**")
-            st.markdown(f"• Words: {result2['word_count']}")
-            st.markdown(f"• Characters: {result2['char_count']}")
-            st.markdown(f"• Words/second: {result2['words_per_second']:.1f}")
+        for column, result, model_name in ((col1, result1, model1_name), (col2, result2, model2_name)):
+            with column:
+                st.markdown(f"**{model_name.split('/')[-1].upper()} Statistics:**")
+                render_result_statistics(result)
+
+# Function to display a single model test result
+def render_single_result(result, model_name):
+    st.markdown("---")
+    st.header(f"Test Results - {model_name.split('/')[-1].upper()}")
+    
+    render_result_panel(result)
+    if result["success"]:
+        render_result_statistics(result)
 
 # Handle button clicks
 if compare_button and prompt and api_key:
     with st.spinner("Loading... Comparing models..."):
-        result1 = make_api_call(model_1, prompt, api_key, max_tokens, temperature)
-        result2 = make_api_call(model_2, prompt, api_key, max_tokens, temperature)
+        # Run both requests in parallel so the wait is the slower model, not the sum of both
+        # (comparing a model with itself sends a single request for two completions)
+        live_col1, live_col2 = st.columns(2)
+        result1, result2 = run_api_calls(
+            [model_1, model_2], [live_col1.empty(), live_col2.empty()],
+            prompt, api_key, max_tokens, temperature
+        )
         
         display_comparison_results(result1, result2, model_1, model_2)
 
-elif test_model_1 and prompt and api_key:
-    with st.spinner(f"Loading... Testing {model_1}..."):
-        result = make_api_call(model_1, prompt, api_key, max_tokens, temperature)
-        
-        st.markdown("---")
-        st.header(f"Test Results - {model_1.split('/')[-1].upper()}")
-        
-        if result["success"]:
-            st.success(f"Generated in {result['response_time']:.2f} seconds")
-            st.markdown("**Result:**")
-            st.text_area("", value=result["content"], height=200, disabled=True)
-            
-            # Statistics
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.metric("Words", result['word_count'])
-            with col2:
-                st.metric("Characters", result['char_count'])
-            with col3:
-                st.metric("Words/sec", f"{result['words_per_second']:.1f}")
-        else:
-            st.error(f"Error: {result['error']}")
-            with st.expander("Debug Info"):
-                st.text(result.get("raw_response", "No debug info available"))
-                if "status_code" in result:
-                    st.text(f"Status Code: {result['status_code']}")
-
-elif test_model_2 and prompt and api_key:
-    with st.spinner(f"Loading... Testing {model_2}..."):
-        result = make_api_call(model_2, prompt, api_key, max_tokens, temperature)
+elif (test_model_1 or test_model_2) and prompt and api_key:
+    model = model_1 if test_model_1 else model_2
+    with st.spinner(f"Loading... Testing {model}..."):
+        result, = run_api_calls([model], [st.empty()], prompt, api_key, max_tokens, temperature)
         
-        st.markdown("---")
-        st.header(f"Test Results - {model_2.split('/')[-1].upper()}")
-        
-        if result["success"]:
-            st.success(f"Generated in {result['response_time']:.2f} seconds")
-            st.markdown("**Result:**")
-            st.text_area("", value=result["content"], height=200, disabled=True)
-            
-            # Statistics
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.metric("Words", result['word_count'])
-            with col2:
-                st.metric("Characters", result['char_count'])
-            with col3:
-                st.metric("Words/sec", f"{result['words_per_second']:.1f}")
-        else:
-            st.error(f"Error: {result['error']}")
-            with st.expander("Debug Info"):
-                st.text(result.get("raw_response", "No debug info available"))
-                if "status_code" in result:
-                    st.text(f"Status Code: {result['status_code']}")
+        render_single_result(result, model)
 
 # Validation messages
 if (compare_button or test_model_1 or test_model_2) and not api_key: